@@ -1,7 +1,7 @@
 # finanzas_app.py
 # --------------------------------------------------------------------------------------
 # Finanzas personales (Streamlit + Supabase)
-# - Cliente Supabase por request + rehidratación de sesión (SIN cache global)
+# - Cliente Supabase por navegador + rehidratación de sesión (SIN cache global)
 # - Login / Registro robustos (SDK v2)
 # - Sesiones aisladas por navegador (st.session_state)
 # - Caché de datos por usuario (user_id)
@@ -9,11 +9,17 @@
 # - RESUMEN POR CATEGORÍA (nuevo)
 # --------------------------------------------------------------------------------------
 
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from dateutil.relativedelta import relativedelta
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from supabase import create_client, Client
 
 # ---------------------------------- Config ----------------------------------
@@ -29,22 +35,34 @@ except Exception:
 def do_rerun():
     getattr(st, "rerun", getattr(st, "experimental_rerun", lambda: None))()
 
-# ------------------------- Supabase client (sin cache) -----------------------
+# ------------------- Supabase client (uno por navegador) ---------------------
 def get_supabase() -> Client:
-    """Crea SIEMPRE un cliente nuevo y lo rehidrata con la sesión guardada en session_state."""
+    """Reutiliza el cliente de este navegador (session_state) y le aplica la sesión guardada."""
     url = st.secrets["SUPABASE_URL"]
     key = st.secrets["SUPABASE_ANON_KEY"]
-    supa = create_client(url, key)
+    supa = st.session_state.get("supa")
+    if supa is None or st.session_state.get("supa_cfg") != (url, key):
+        supa = create_client(url, key)
+        st.session_state["supa"] = supa
+        st.session_state["supa_cfg"] = (url, key)
+        st.session_state.pop("sb_session_token", None)  # cliente nuevo: sin sesión aplicada
+    ensure_session(supa)
+    return supa
 
+def ensure_session(supa: Client):
+    """Rehidrata el cliente con sb_session; no-op si ese token ya está aplicado (sb_session_token)."""
     sess = st.session_state.get("sb_session")
-    if isinstance(sess, dict) and sess.get("access_token") and sess.get("refresh_token"):
-        try:
-            supa.auth.set_session(sess["access_token"], sess["refresh_token"])
-        except Exception:
-            # si falla, limpiamos sesión corrupta
-            for k in ("sb_session", "user"):
-                st.session_state.pop(k, None)
-    return supa
+    if not (isinstance(sess, dict) and sess.get("access_token") and sess.get("refresh_token")):
+        return
+    if st.session_state.get("sb_session_token") == sess["access_token"]:
+        return
+    try:
+        supa.auth.set_session(sess["access_token"], sess["refresh_token"])
+        st.session_state["sb_session_token"] = sess["access_token"]
+    except Exception:
+        # si falla, limpiamos sesión corrupta
+        for k in ("sb_session", "user", "sb_session_token"):
+            st.session_state.pop(k, None)
 
 # ------------------------------ Auth helpers --------------------------------
 def sign_in(email: str, password: str):
@@ -56,7 +74,8 @@ def sign_in(email: str, password: str):
         "access_token": res.session.access_token,
         "refresh_token": res.session.refresh_token,
     }
-    st.cache_data.clear()
+    # El cliente ya tiene esta sesión (sign_in_with_password): no re-aplicarla
+    st.session_state["sb_session_token"] = res.session.access_token
     do_rerun()
 
 def sign_up(email: str, password: str):
@@ -64,14 +83,19 @@ def sign_up(email: str, password: str):
     supa.auth.sign_up({"email": email, "password": password})
 
 def sign_out():
+    user_id = (st.session_state.get("user") or {}).get("id")
     try:
         get_supabase().auth.sign_out()
     except Exception:
         pass
-    # Limpiar absolutamente todo lo sensible
-    for k in ("user", "sb_session"):
+    # Limpiar absolutamente todo lo sensible (incluido el cliente autenticado)
+    for k in ("user", "sb_session", "sb_session_token", "supa", "supa_cfg", "defaults_done"):
         st.session_state.pop(k, None)
-    st.cache_data.clear()
+    # ...y sus datos cacheados, sin vaciar la caché del resto de los usuarios
+    if user_id:
+        load_categories.clear(user_id)
+        load_category_counts.clear(user_id)
+        bump_tx_generation(user_id)  # sus períodos (cache_resource) quedan inalcanzables
     do_rerun()
 
 def current_user():
@@ -80,7 +104,11 @@ def current_user():
     if isinstance(st.session_state.get("user"), dict) and st.session_state["user"].get("id"):
         return st.session_state["user"]
 
-    # Si no, intentamos preguntarle al SDK (cookies v2)
+    # Sin tokens guardados no hay nada que rehidratar: evitamos el round-trip a gotrue
+    if not st.session_state.get("sb_session"):
+        return None
+
+    # Si no, intentamos preguntarle al SDK con la sesión rehidratada
     try:
         res = get_supabase().auth.get_user()
         if res and res.user:
@@ -91,24 +119,178 @@ def current_user():
     return None
 
 # ----------------------------- Data layer (RLS) ------------------------------
-@st.cache_data(ttl=60)
-def load_transactions(user_id: str) -> pd.DataFrame:
-    supa = get_supabase()
-    res = supa.table("transactions").select("*").eq("user_id", user_id).order("tdate").execute()
-    data = res.data or []
-    df = pd.DataFrame(data, columns=["id","user_id","tdate","amount","kind","category","note"])
+TX_COLUMNS = ["id","tdate","amount","kind","category","note"]
+
+def tx_dataframe(data: list) -> pd.DataFrame:
+    """Arma el DataFrame de movimientos con tipos ya coercionados."""
+    df = pd.DataFrame(data, columns=TX_COLUMNS)
     if not df.empty:
-        df["tdate"] = pd.to_datetime(df["tdate"], errors="coerce")
-        df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0.0)
+        # tdate es columna date: Supabase la devuelve ISO (YYYY-MM-DD) -> parser rápido en C
+        df["tdate"] = pd.to_datetime(df["tdate"], format="%Y-%m-%d", errors="coerce")
+        df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0.0).astype("float64")
+    # Categóricas: comparaciones y groupby sobre códigos enteros en vez de str
+    df["kind"] = df["kind"].astype("category")
+    df["category"] = df["category"].astype("category")
+    # note es texto libre (no se repite): string de Arrow en vez de objetos str de Python
+    df["note"] = df["note"].astype("string[pyarrow]")
     return df
 
-@st.cache_data(ttl=60)
+def load_transactions_range(user_id: str, start_iso: str, end_iso: str) -> pd.DataFrame:
+    """Movimientos del usuario dentro de [start_iso, end_iso]; el filtro lo resuelve Postgres.
+
+    Sin caché propia: su único llamador es filtered_view, que ya memoiza el resultado.
+    """
+    supa = get_supabase()
+    res = (
+        supa.table("transactions")
+            .select(",".join(TX_COLUMNS))
+            .eq("user_id", user_id)
+            .gte("tdate", start_iso)
+            .lte("tdate", end_iso)
+            .order("tdate")
+            .execute()
+    )
+    return tx_dataframe(res.data or [])
+
+def cum_by_day(days: np.ndarray, signed: np.ndarray):
+    """Suma por día + acumulado. `days` debe venir ordenado ascendente (datetime64[D])."""
+    new_day = days[1:] != days[:-1]
+    if new_day.all():
+        # ya hay un movimiento por día (caso típico en "Hoy"/"Este mes"): cumsum directo
+        return days, np.cumsum(signed)
+    starts = np.flatnonzero(np.r_[True, new_day])
+    return days[starts], np.cumsum(np.add.reduceat(signed, starts))
+
+def balance_points(fdf: pd.DataFrame) -> pd.DataFrame:
+    """Saldo acumulado por día (ingreso suma; gasto e inversión restan).
+
+    fdf llega ordenado por tdate desde la query (order("tdate")).
+    """
+    sign = np.where(fdf["kind"].to_numpy() == "ingreso", 1.0, -1.0)
+    signed = fdf["amount"].to_numpy() * sign
+    days, saldo = cum_by_day(fdf["tdate"].to_numpy().astype("datetime64[D]"), signed)
+    return pd.DataFrame({"tdate": days, "saldo": saldo})
+
+@st.cache_resource
+def tx_generations() -> dict:
+    """Generación de datos por usuario, compartida entre sesiones: {"lock", "by_user": {user_id: n}}."""
+    return {"lock": threading.Lock(), "by_user": {}}
+
+def tx_generation(user_id: str) -> int:
+    return tx_generations()["by_user"].get(user_id, 0)
+
+def bump_tx_generation(user_id: str):
+    """Invalida los períodos cacheados SOLO de este usuario (cambia la clave de filtered_view)."""
+    gens = tx_generations()
+    with gens["lock"]:
+        gens["by_user"][user_id] = gens["by_user"].get(user_id, 0) + 1
+
+@st.cache_resource(ttl=60, show_spinner=False)
+def filtered_view(user_id: str, start_iso: str, end_iso: str, generation: int):
+    """Movimientos del período + agregados memoizados por (usuario, rango, generación).
+
+    `generation` = tx_generation(user_id): una escritura del usuario la incrementa y
+    sus entradas viejas quedan inalcanzables (expiran por TTL) sin tocar a los demás.
+
+    Una sola pasada por (kind, category) alimenta tanto los KPIs como el resumen
+    por categoría; ambos se derivan de ese frame chico.
+
+    cache_resource: un hit devuelve los mismos objetos, sin la copia (pickle) de
+    cache_data. Son de SOLO LECTURA: no mutarlos, derivar frames nuevos.
+    """
+    fdf = load_transactions_range(user_id, start_iso, end_iso)
+    if fdf.empty:
+        return fdf, {}, None, None
+    by_cat = (
+        # dropna=False: movimientos sin categoría igual cuentan en los KPIs
+        fdf.groupby(["kind", "category"], observed=True, dropna=False)
+           .agg(total=("amount", "sum"), operaciones=("id", "count"))
+           .reset_index()
+    )
+    totals = by_cat.groupby("kind", observed=True)["total"].sum().to_dict()
+    return fdf, totals, balance_points(fdf), by_cat
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_category_counts(user_id: str) -> dict | None:
+    """{categoría: cantidad de movimientos} para todas las categorías, en un solo RPC (ver supabase.sql).
+
+    None si la base todavía no tiene la función: category_count usa entonces count=exact.
+    """
+    try:
+        res = get_supabase().rpc("tx_counts_by_category", {"uid": user_id}).execute()
+    except Exception as e:
+        # PGRST202 / 42883: función inexistente (supabase.sql sin aplicar)
+        if getattr(e, "code", None) not in ("PGRST202", "42883"):
+            raise
+        return None
+    return {r["category"]: r["cnt"] for r in (res.data or [])}
+
+@st.cache_data(ttl=60, show_spinner=False)
+def count_transactions(user_id: str, category: str, generation: int) -> int:
+    """Cantidad de movimientos de una categoría; el conteo viaja en el header (count=exact)."""
+    res = (
+        get_supabase().table("transactions")
+            .select("id", count="exact")
+            .eq("user_id", user_id)
+            .eq("category", category)
+            .limit(1)
+            .execute()
+    )
+    return res.count or 0
+
+def category_count(user_id: str, category: str) -> int:
+    counts = load_category_counts(user_id)
+    if counts is None:
+        return count_transactions(user_id, category, tx_generation(user_id))
+    return counts.get(category, 0)
+
+CACHE_HIT_MS = 5.0  # un hit responde en µs; un miss paga la red (~100 ms)
+
+def filtered_view_observed(user_id: str, start_iso: str, end_iso: str):
+    """filtered_view + contadores hit/miss por navegador (st.session_state["cache_stats"])."""
+    t0 = time.perf_counter()
+    out = filtered_view(user_id, start_iso, end_iso, tx_generation(user_id))
+    ms = (time.perf_counter() - t0) * 1000
+    stats = st.session_state.setdefault("cache_stats", {"hits": 0, "misses": 0, "total_ms": 0.0, "last_ms": 0.0})
+    stats["hits" if ms < CACHE_HIT_MS else "misses"] += 1
+    stats["total_ms"] += ms
+    stats["last_ms"] = ms
+    return out
+
+@st.cache_data(ttl=300, show_spinner=False)  # cambia solo vía add/delete/ensure, que invalidan explícitamente
 def load_categories(user_id: str) -> pd.DataFrame:
     supa = get_supabase()
     res = supa.table("categories").select("id,name,kind").eq("user_id", user_id).order("name").execute()
     data = res.data or []
     return pd.DataFrame(data, columns=["id","name","kind"])
 
+def fetch_concurrently(*calls):
+    """Corre en paralelo lecturas independientes [(fn, *args), ...] y devuelve sus resultados.
+
+    Cada hilo hereda el ScriptRunContext del rerun (session_state, secrets, cachés).
+    El cliente Supabase debe existir antes (get_supabase en el hilo principal) y las
+    funciones cacheadas deben usar show_spinner=False (no crear elementos desde hilos).
+    """
+    ctx = get_script_run_ctx()
+
+    def run(fn, *args):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args)
+
+    with ThreadPoolExecutor(max_workers=len(calls)) as ex:
+        futures = [ex.submit(run, *call) for call in calls]
+        return [f.result() for f in futures]
+
+# Invalidación puntual (no st.cache_data.clear(), que vacía la caché de todos):
+# - categorías  -> load_categories(user_id)
+# - movimientos -> filtered_view, count_transactions (por generación), load_category_counts(user_id)
+# .clear(args) borra solo esa entrada (Streamlit >= 1.34). Los períodos se invalidan
+# por usuario subiendo su generación (parte de la clave de filtered_view).
+# Los gráficos se memoizan por su input, no hace falta invalidarlos.
+def clear_transaction_caches(user_id: str):
+    bump_tx_generation(user_id)
+    load_category_counts.clear(user_id)
+
 def ensure_default_categories(user_id: str):
     supa = get_supabase()
     cat_df = load_categories(user_id)
@@ -121,23 +303,31 @@ def ensure_default_categories(user_id: str):
         ("Salud","gasto"), ("Educación","gasto"),
         ("Ahorro/ETF","inversion"), ("Cripto","inversion"), ("Plazo Fijo","inversion"),
     ]
-    for name, kind in defaults:
-        try:
-            supa.table("categories").insert({"user_id": user_id, "name": name, "kind": kind}).execute()
-        except Exception:
-            pass
-    st.cache_data.clear()
+    # Un único insert masivo: 1 round-trip en lugar de 12.
+    # ON CONFLICT (user_id, name) DO NOTHING: idempotente si dos pestañas lo corren a la vez
+    rows = [{"user_id": user_id, "name": name, "kind": kind} for name, kind in defaults]
+    try:
+        supa.table("categories").upsert(rows, on_conflict="user_id,name", ignore_duplicates=True).execute()
+    except Exception as e:
+        # 42P10: falta el índice único (migracion_categorias_unicas.sql) -> no hay ON CONFLICT posible
+        if getattr(e, "code", None) != "42P10":
+            raise
+        supa.table("categories").insert(rows).execute()
+    load_categories.clear(user_id)
 
 def add_category(user_id: str, name: str, kind: str):
     get_supabase().table("categories").insert({"user_id": user_id, "name": name.strip(), "kind": kind}).execute()
-    st.cache_data.clear()
+    load_categories.clear(user_id)
 
 def delete_category(user_id: str, name: str, reassign_to: str | None):
-    supa = get_supabase()
-    if reassign_to:
-        supa.table("transactions").update({"category": reassign_to}).eq("user_id", user_id).eq("category", name).execute()
-    supa.table("categories").delete().eq("user_id", user_id).eq("name", name).execute()
-    st.cache_data.clear()
+    # Reasignación + borrado atómicos en un solo round-trip (ver supabase.sql)
+    get_supabase().rpc("delete_category_with_reassign", {
+        "p_user": user_id,
+        "p_name": name,
+        "p_reassign": reassign_to,
+    }).execute()
+    load_categories.clear(user_id)
+    clear_transaction_caches(user_id)  # la reasignación toca movimientos
 
 def add_transaction(user_id: str, tdate: date, amount: float, kind: str, category: str, note: str):
     get_supabase().table("transactions").insert({
@@ -148,11 +338,31 @@ def add_transaction(user_id: str, tdate: date, amount: float, kind: str, categor
         "category": category,
         "note": note or "",
     }).execute()
-    st.cache_data.clear()
+    clear_transaction_caches(user_id)
 
 def delete_transaction(user_id: str, tx_id: int):
     get_supabase().table("transactions").delete().eq("user_id", user_id).eq("id", tx_id).execute()
-    st.cache_data.clear()
+    clear_transaction_caches(user_id)
+
+# -------------------------------- Gráficos ----------------------------------
+@st.cache_data(ttl=60)
+def build_balance_fig(points_df: pd.DataFrame):
+    import plotly.express as px  # lazy: la pantalla de login no carga plotly
+    fig = px.line(points_df, x="tdate", y="saldo", markers=True, title="Balance histórico")
+    fig.update_layout(height=360, margin=dict(l=10, r=10, t=40, b=0))
+    return fig
+
+@st.cache_data(ttl=60)
+def build_category_fig(resumen: pd.DataFrame, titulo: str):
+    import plotly.express as px
+    fig = px.bar(
+        resumen,
+        x="category", y="total",
+        title=f"Total por categoría — {titulo}",
+        text_auto=True
+    )
+    fig.update_layout(height=360, margin=dict(l=10, r=10, t=40, b=0))
+    return fig
 
 # ------------------------------- UI: Auth -----------------------------------
 def ui_auth():
@@ -193,9 +403,60 @@ def ui_auth():
 
 
 # ----------------------------- UI: App principal -----------------------------
+PERIOD_PRESETS = {
+    "Hoy":      lambda t: (t, t),
+    "Este mes": lambda t: (t.replace(day=1), t),
+    "Este año": lambda t: (date(t.year, 1, 1), t),
+}
+
 def ui_app(user: dict):
     user_id = user["id"]
-    ensure_default_categories(user_id)
+    # Las categorías por defecto se chequean una vez por sesión (y por usuario)
+    if st.session_state.get("defaults_done") != user_id:
+        try:
+            ensure_default_categories(user_id)
+            st.session_state["defaults_done"] = user_id  # solo si salió bien: si no, se reintenta
+        except Exception as e:
+            st.warning(f"No se pudieron crear las categorías por defecto: {e}")
+
+    # ------------------- Main content -------------------
+    # (el período se resuelve antes que el sidebar para poder leer todo en paralelo)
+    st.title("💸 Finanzas personales")
+
+    # Periodo: un único widget (cada click = un solo rerun, sin do_rerun)
+    today = date.today()
+    if "period_start" not in st.session_state:
+        st.session_state["period_start"] = today.replace(day=1)
+    if "period_end" not in st.session_state:
+        st.session_state["period_end"] = today
+
+    preset = st.radio(
+        "Rango",
+        ["Personalizado", *PERIOD_PRESETS],
+        horizontal=True,
+        index=2,  # "Este mes"
+        key="period_preset"
+    )
+    c1, c2 = st.columns(2)
+    if preset in PERIOD_PRESETS:
+        start, end = PERIOD_PRESETS[preset](today)
+        c1.date_input("Desde", value=start, disabled=True)
+        c2.date_input("Hasta", value=end, disabled=True)
+    else:
+        start = c1.date_input("Desde", value=st.session_state["period_start"])
+        end   = c2.date_input("Hasta", value=st.session_state["period_end"])
+    if (start, end) != (st.session_state["period_start"], st.session_state["period_end"]):
+        st.session_state["period_start"], st.session_state["period_end"] = start, end
+
+    # Lecturas independientes en paralelo (categorías, período, conteos): en frío
+    # se paga un solo round-trip en vez de tres seguidos
+    get_supabase()
+    start_iso, end_iso = start.isoformat(), end.isoformat()
+    cats_df, _, _ = fetch_concurrently(
+        (load_categories, user_id),
+        (filtered_view_observed, user_id, start_iso, end_iso),
+        (load_category_counts, user_id),
+    )
 
     # --- Sidebar: sesión + logout ---
     st.sidebar.success(f"Sesión: {user.get('email','')}")
@@ -206,7 +467,6 @@ def ui_app(user: dict):
     st.sidebar.header("➕ Agregar movimiento")
     tdate = st.sidebar.date_input("Fecha", value=date.today())
     kind  = st.sidebar.selectbox("Tipo", ["ingreso","gasto","inversion"])
-    cats_df = load_categories(user_id)
     cats_opts = cats_df.loc[cats_df["kind"] == kind, "name"].tolist() or ["(sin categorías)"]
     category = st.sidebar.selectbox("Categoría", cats_opts)
     amount = st.sidebar.number_input("Monto", min_value=0.0, step=100.0, format="%.2f")
@@ -229,19 +489,21 @@ def ui_app(user: dict):
         new_kind = st.selectbox("Tipo", ["ingreso","gasto","inversion"], key="new_kind")
         if st.button("Guardar categoría"):
             if new_name.strip():
-                add_category(user_id, new_name.strip(), new_kind)
-                st.success("Categoría guardada.")
+                try:
+                    add_category(user_id, new_name.strip(), new_kind)
+                    st.success("Categoría guardada.")
+                except Exception as e:
+                    st.error(f"No se pudo guardar (¿ya existe esa categoría?): {e}")
             else:
                 st.warning("Poné un nombre.")
 
         st.divider()
         st.subheader("Eliminar categoría")
-        all_cats = load_categories(user_id)["name"].tolist()
+        all_cats = cats_df["name"].tolist()
         cat_del = st.selectbox("Categoría a borrar", all_cats) if all_cats else None
 
-        # Contar movimientos asociados
-        tx_df = load_transactions(user_id)
-        count_assoc = int((tx_df["category"] == cat_del).sum()) if (cat_del and not tx_df.empty) else 0
+        # Contar movimientos asociados (hit de caché salvo que "Agregar" acabe de escribir)
+        count_assoc = category_count(user_id, cat_del) if cat_del else 0
         st.caption(f"Movimientos asociados: **{count_assoc}**")
 
         reassign_to = None
@@ -260,49 +522,14 @@ def ui_app(user: dict):
             else:
                 st.warning("No hay categoría para borrar.")
 
-    # ------------------- Main content -------------------
-    st.title("💸 Finanzas personales")
-
-    # Periodo rápido
-    colp1, colp2, colp3, colp4 = st.columns(4)
-    today = date.today()
-    if "period_start" not in st.session_state:
-        st.session_state["period_start"] = today.replace(day=1)
-    if "period_end" not in st.session_state:
-        st.session_state["period_end"] = today
-
-    if colp1.button("Hoy"):
-        st.session_state["period_start"] = today
-        st.session_state["period_end"] = today
-        do_rerun()
-    if colp2.button("Este mes"):
-        st.session_state["period_start"] = today.replace(day=1)
-        st.session_state["period_end"] = today
-        do_rerun()
-    if colp3.button("Este año"):
-        st.session_state["period_start"] = date(today.year,1,1)
-        st.session_state["period_end"] = today
-        do_rerun()
-    colp4.write(" ")
-
-    # Rango manual
-    c1, c2 = st.columns(2)
-    start = c1.date_input("Desde", value=st.session_state["period_start"])
-    end   = c2.date_input("Hasta", value=st.session_state["period_end"])
-    if (start, end) != (st.session_state["period_start"], st.session_state["period_end"]):
-        st.session_state["period_start"], st.session_state["period_end"] = start, end
-
-    # Datos
-    df = load_transactions(user_id)
-    if not df.empty:
-        fdf = df[(df["tdate"] >= pd.to_datetime(start)) & (df["tdate"] <= pd.to_datetime(end))].copy()
-    else:
-        fdf = df.copy()
+    # Datos (solo el período visible viaja por la red). Si el sidebar escribió en
+    # este rerun, la caché se invalidó y esto vuelve a leer; si no, es un hit sin copia.
+    fdf, totals, g, by_cat = filtered_view(user_id, start_iso, end_iso, tx_generation(user_id))
 
     # KPIs
-    ing = fdf.loc[fdf["kind"]=="ingreso","amount"].sum() if not fdf.empty else 0.0
-    gas = fdf.loc[fdf["kind"]=="gasto","amount"].sum() if not fdf.empty else 0.0
-    inv = fdf.loc[fdf["kind"]=="inversion","amount"].sum() if not fdf.empty else 0.0
+    ing = totals.get("ingreso", 0.0)
+    gas = totals.get("gasto", 0.0)
+    inv = totals.get("inversion", 0.0)
     balance = ing - gas - inv
     positivo = balance >= 0
     color = "#16a34a" if positivo else "#dc2626"
@@ -322,14 +549,7 @@ def ui_app(user: dict):
     if fdf.empty:
         st.info("Aún no hay datos para graficar.")
     else:
-        tmp = fdf.sort_values("tdate").copy()
-        tmp["delta"] = tmp.apply(lambda r: r["amount"] if r["kind"]=="ingreso" else -r["amount"], axis=1)
-        tmp.loc[tmp["kind"]=="inversion", "delta"] = -tmp["amount"]  # inversión como salida
-        g = tmp.groupby("tdate", as_index=False)["delta"].sum()
-        g["saldo"] = g["delta"].cumsum()
-        fig = px.line(g, x="tdate", y="saldo", markers=True, title="Balance histórico")
-        fig.update_layout(height=360, margin=dict(l=10, r=10, t=40, b=0))
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(build_balance_fig(g), use_container_width=True)
 
     # --------- Resumen por categoría (suma y % del total) ----------
     st.markdown("### 📊 Resumen por categoría")
@@ -347,19 +567,19 @@ def ui_app(user: dict):
         )
 
         if "salidas" in tipo:
-            sub = fdf[fdf["kind"].isin(["gasto", "inversion"])].copy()
+            sub = by_cat[by_cat["kind"].isin(("gasto", "inversion"))]
             titulo = "Salidas (gasto + inversión)"
         else:
-            sub = fdf[fdf["kind"] == tipo].copy()
+            sub = by_cat[by_cat["kind"] == tipo]
             titulo = tipo.capitalize()
 
         if sub.empty:
             st.info(f"No hay movimientos de **{titulo}** en el rango seleccionado.")
         else:
-            # Agrupar por categoría
+            # Agrupar por categoría (sobre el agregado, no sobre los movimientos)
             resumen = (
-                sub.groupby("category", as_index=False)
-                   .agg(total=("amount", "sum"), operaciones=("id", "count"))
+                sub.groupby("category", as_index=False, observed=True)[["total", "operaciones"]]
+                   .sum()
                    .sort_values("total", ascending=False)
             )
             total_general = resumen["total"].sum()
@@ -373,19 +593,17 @@ def ui_app(user: dict):
             )
 
             # Gráfico
-            fig_cat = px.bar(
-                resumen,
-                x="category", y="total",
-                title=f"Total por categoría — {titulo}",
-                text_auto=True
-            )
-            fig_cat.update_layout(height=360, margin=dict(l=10, r=10, t=40, b=0))
-            st.plotly_chart(fig_cat, use_container_width=True)
-
-            # Exportar CSV
+            st.plotly_chart(build_category_fig(resumen, titulo), use_container_width=True)
+
+            # Exportar CSV (Arrow escribe UTF-8 directo al buffer, sin str intermedio).
+            # Formato distinto a to_csv, a propósito: encabezados y textos van entre comillas
+            # y los float enteros salen como 250 (no 250.0); sigue siendo CSV RFC 4180.
+            # quoting_style="none" no sirve: falla si una categoría tiene coma o comillas.
+            buf = io.BytesIO()
+            pacsv.write_csv(pa.Table.from_pandas(resumen, preserve_index=False), buf)
             st.download_button(
                 "⬇️ Exportar resumen (CSV)",
-                data=resumen.to_csv(index=False).encode("utf-8"),
+                data=buf.getvalue(),
                 file_name=f"resumen_categorias_{tipo.replace(' ','_')}.csv",
                 mime="text/csv",
                 use_container_width=True
@@ -395,7 +613,7 @@ def ui_app(user: dict):
     st.markdown("### Movimientos del período")
     if not fdf.empty:
         st.dataframe(
-            fdf[["id","tdate","kind","category","amount","note"]].sort_values("tdate", ascending=False),
+            fdf[["id","tdate","kind","category","amount","note"]].iloc[::-1],  # ya viene ordenado por tdate
             use_container_width=True,
             hide_index=True
         )
@@ -410,6 +628,16 @@ def ui_app(user: dict):
     else:
         st.write("—")
 
+    # --- Sidebar: diagnóstico de caché ---
+    with st.sidebar.expander("🛠️ Caché (debug)", expanded=False):
+        stats = st.session_state.get("cache_stats", {})
+        hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+        st.caption(
+            f"Hits: **{hits}** · Misses: **{misses}** · "
+            f"Último: {stats.get('last_ms', 0.0):.1f} ms · "
+            f"Promedio: {stats.get('total_ms', 0.0) / max(hits + misses, 1):.1f} ms"
+        )
+
 # ------------------------------------ Main -----------------------------------
 def main():
     user = current_user()
@@ -0,0 +1,53 @@
+-- migracion_categorias_unicas.sql
+-- --------------------------------------------------------------------------------------
+-- Migración ÚNICA (no re-ejecutar a ciegas): crea el índice único categories(user_id, name)
+-- que usa ensure_default_categories (ON CONFLICT). Antes no había restricción, así que una
+-- base vieja puede tener categorías repetidas por usuario.
+--
+-- Pasos:
+--   1) Correr la consulta de REPORTE y revisar el resultado.
+--   2) Si hay duplicados con distinto tipo (kind), resolverlos a mano (renombrar o borrar
+--      la que corresponda): la migración se niega a elegir por vos.
+--   3) Correr el bloque MIGRACIÓN: elimina solo duplicados idénticos (mismo user_id, name y
+--      kind; da igual cuál queda porque los movimientos referencian la categoría por nombre),
+--      informa cuántos borró y crea el índice.
+-- --------------------------------------------------------------------------------------
+
+-- 1) REPORTE: categorías repetidas por usuario
+select user_id, name,
+       count(*)                              as filas,
+       array_agg(distinct kind)              as tipos,
+       count(distinct kind) > 1              as conflicto
+  from categories
+ group by user_id, name
+having count(*) > 1
+ order by conflicto desc, user_id, name;
+
+-- 3) MIGRACIÓN
+do $$
+declare
+  conflictos int;
+  borradas   int;
+begin
+  select count(*) into conflictos
+    from (select 1
+            from categories
+           group by user_id, name
+          having count(distinct kind) > 1) x;
+  if conflictos > 0 then
+    raise exception '% categorías repetidas con distinto tipo: resolverlas a mano (ver REPORTE)', conflictos;
+  end if;
+
+  -- duplicados idénticos: se conserva una fila cualquiera (la de menor id) de cada grupo
+  delete from categories c
+   using categories d
+   where c.user_id = d.user_id
+     and c.name = d.name
+     and c.kind = d.kind
+     and c.id > d.id;
+  get diagnostics borradas = row_count;
+  raise notice 'Duplicados idénticos eliminados: %', borradas;
+
+  create unique index if not exists idx_cat_user_name on categories (user_id, name);
+end
+$$;
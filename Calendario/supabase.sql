@@ -0,0 +1,38 @@
+-- supabase.sql
+-- --------------------------------------------------------------------------------------
+-- Funciones / índices que usa finanzas_app.py
+-- Ejecutar en el SQL Editor del proyecto Supabase (idempotente: se puede re-ejecutar).
+-- Solo DDL: no modifica datos.
+-- Las funciones corren como el usuario que llama (security invoker) => aplican las RLS.
+-- --------------------------------------------------------------------------------------
+
+-- Borrar categoría (reasignando antes sus movimientos) en UNA transacción / round-trip
+create or replace function delete_category_with_reassign(p_user uuid, p_name text, p_reassign text)
+returns void
+language plpgsql
+as $$
+begin
+  if p_reassign is not null then
+    update transactions set category = p_reassign
+     where user_id = p_user and category = p_name;
+  end if;
+  delete from categories where user_id = p_user and name = p_name;
+end
+$$;
+
+-- Movimientos por categoría del usuario (admin de categorías): una sola consulta para todas
+create or replace function tx_counts_by_category(uid uuid)
+returns table(category text, cnt bigint)
+language sql
+stable
+as $$
+  select t.category, count(*) as cnt
+    from transactions t
+   where t.user_id = uid
+   group by t.category
+$$;
+
+-- Índices para los filtros calientes (user_id + rango de fechas / nombre de categoría)
+create index if not exists idx_tx_user_tdate on transactions (user_id, tdate desc);
+-- El índice único categories(user_id, name) va aparte, en migracion_categorias_unicas.sql:
+-- bases viejas pueden tener duplicados y hay que revisarlos antes de crearlo.